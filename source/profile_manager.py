@@ -2,9 +2,16 @@
 Менеджер профилей XLog — работа с файлами профилей на Яндекс.Диске
 """
 
+import asyncio
+import atexit
+import concurrent.futures
 import logging
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Any
 
 from .yadisk_client import YandexDiskClient
 from .logger import logger
@@ -17,8 +24,16 @@ FilesDict = Dict[str, Optional[str]]
 class ProfileManager:
     """Управляет профилями и их файлами на Яндекс.Диске"""
 
-    # Список файлов, которые должны быть в каждом профиле
-    PROFILE_FILES = ["key.docx", "king.docx", "rules.docx", "library.docx", "welcome.docx"]
+    # Файлы, которые должны быть в каждом профиле: (ключ, имя файла).
+    # Пары посчитаны один раз, чтобы не выводить ключ из имени на каждый вызов
+    PROFILE_FILES = (
+        ("key", "key.docx"),
+        ("king", "king.docx"),
+        ("rules", "rules.docx"),
+        ("library", "library.docx"),
+        ("welcome", "welcome.docx"),
+    )
+    PROFILE_FILE_KEYS = tuple(key for key, _ in PROFILE_FILES)
 
     def __init__(self, disk_client: YandexDiskClient, config: Dict[str, Any]):
         """
@@ -31,44 +46,142 @@ class ProfileManager:
         self.disk = disk_client
         self.config = config
         self.profiles = config.get("profiles", [])
+
+        # Кэш файлов профилей: profile_name -> (время загрузки, файлы)
+        self._files_cache: Dict[str, tuple] = {}
+        self._cache_ttl = 60  # секунд
+        self._cache_lock = threading.Lock()
+
+        # Буферы логов: log_path -> накопленные строки.
+        # Вместо download+upload на каждое сообщение пишем пачками.
+        self._log_buffers: Dict[str, List[str]] = defaultdict(list)
+        self._last_flush: Dict[str, float] = {}
+        self._log_lock = threading.Lock()
+        # Сериализует сами выгрузки: дозапись на Диск не атомарна
+        self._flush_lock = threading.Lock()
+        self._flush_batch_size = 32  # строк
+        self._flush_interval = 5  # секунд
+
+        # Незавершённые асинхронные загрузки: одинаковые одновременные
+        # запросы ждут одну и ту же задачу вместо повторной загрузки
+        self._inflight: Dict[Any, asyncio.Task] = {}
+
+        self._schedule_flush()
+        atexit.register(self._flush_all)
+
         logger.info(f"ProfileManager initialized with {len(self.profiles)} profiles")
 
     def get_all_profiles(self) -> List[ProfileDict]:
         """Возвращает список всех доступных профилей"""
         return self.profiles
 
-    def get_profile_files(self, profile_name: str) -> FilesDict:
+    def get_profile_files(self, profile_name: str,
+                          keys: Optional[Iterable[str]] = None) -> FilesDict:
         """
-        Читает ВСЕ файлы профиля с Яндекс.Диска.
+        Читает файлы профиля с Яндекс.Диска.
+
+        Файлы скачиваются параллельно (это чистый сетевой I/O),
+        поэтому общее время примерно равно времени самого медленного файла.
+        Результат кэшируется в памяти на self._cache_ttl секунд, чтобы
+        повторные сборки контекста не скачивали одни и те же файлы заново.
+
+        Args:
+            profile_name: Имя профиля
+            keys: Какие файлы нужны (например ("king", "rules")).
+                  По умолчанию — все PROFILE_FILES.
 
         Returns:
-            Словарь с содержимым файлов: key, king, rules, library, welcome
+            Словарь с содержимым запрошенных файлов
         """
-        files = {}
+        wanted = self.PROFILE_FILE_KEYS if keys is None else tuple(keys)
+        if not wanted:
+            return {}
 
-        for file_name in self.PROFILE_FILES:
-            key = file_name.replace('.docx', '')
-            try:
-                path = f"{profile_name}/{file_name}"
-                content = self.disk.read_file(path)
+        with self._cache_lock:
+            cached = self._files_cache.get(profile_name)
+            if (cached and time.monotonic() - cached[0] < self._cache_ttl
+                    and all(k in cached[1] for k in wanted)):
+                logger.debug(f"Profile {profile_name}: files served from cache")
+                return {k: cached[1][k] for k in wanted}
 
-                if content:
-                    files[key] = content
-                    logger.debug(f"Loaded {file_name}: {len(content)} chars")
-                else:
+        files = {}
+        failed = set()
+        paths = [(key, f"{profile_name}/{key}.docx") for key in wanted]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            futures = {executor.submit(self.disk.read_file, path): key
+                       for key, path in paths}
+
+            for future in concurrent.futures.as_completed(futures):
+                key = futures[future]
+                try:
+                    content = future.result()
+
+                    if content:
+                        files[key] = content
+                        logger.debug(f"Loaded {key}.docx: {len(content)} chars")
+                    else:
+                        files[key] = ""
+                        logger.warning(f"File {key}.docx is empty")
+
+                except Exception as e:
+                    logger.error(f"Failed to read {key}.docx: {e}")
                     files[key] = ""
-                    logger.warning(f"File {file_name} is empty")
-
-            except Exception as e:
-                logger.error(f"Failed to read {file_name}: {e}")
-                files[key] = ""
+                    failed.add(key)
 
         loaded = [k for k, v in files.items() if v]
         empty = [k for k, v in files.items() if not v]
         logger.info(f"Profile {profile_name}: loaded {loaded}, empty {empty}")
 
+        with self._cache_lock:
+            # Дополняем ещё живой кэш, чтобы частичная выборка
+            # не затирала уже загруженные файлы. Ключи, упавшие с ошибкой,
+            # в кэш не попадают — следующий вызов перечитает их заново
+            cached = self._files_cache.get(profile_name)
+            if cached and time.monotonic() - cached[0] < self._cache_ttl:
+                merged = dict(cached[1])
+            else:
+                merged = {}
+            merged.update({k: v for k, v in files.items() if k not in failed})
+            if merged:
+                self._files_cache[profile_name] = (time.monotonic(), merged)
+
         return files
 
+    async def aget_profile_files(self, profile_name: str,
+                                 keys: Optional[Iterable[str]] = None) -> FilesDict:
+        """
+        Асинхронный вариант get_profile_files для вызова из event loop.
+
+        Блокирующая загрузка уходит в поток, а одновременные запросы
+        одного и того же профиля склеиваются в одну загрузку (singleflight).
+        """
+        # Материализуем keys один раз: генератор нельзя прочитать дважды
+        if keys is not None:
+            keys = tuple(keys)
+        flight_key = (profile_name, keys)
+
+        task = self._inflight.get(flight_key)
+        if task is None:
+            task = asyncio.create_task(
+                asyncio.to_thread(self.get_profile_files, profile_name, keys)
+            )
+            self._inflight[flight_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(flight_key, None))
+        else:
+            logger.debug(f"Profile {profile_name}: joined in-flight fetch")
+
+        return await task
+
+    async def abuild_context(self, profile_name: str, limit: int = 10) -> str:
+        """Асинхронный вариант build_context: не блокирует event loop"""
+        return await asyncio.to_thread(self.build_context, profile_name, limit)
+
+    def _invalidate_cache(self, profile_name: str):
+        """Сбрасывает кэш файлов профиля после записи"""
+        with self._cache_lock:
+            self._files_cache.pop(profile_name, None)
+
     def save_profile_file(self, profile_name: str, file_key: str, content: str) -> bool:
         """
         Сохраняет содержимое в файл профиля.
@@ -83,7 +196,52 @@ class ProfileManager:
         """
         file_name = f"{file_key}.docx"
         path = f"{profile_name}/{file_name}"
-        return self.disk.write_file(path, content)
+        success = self.disk.write_file(path, content)
+        if success:
+            self._invalidate_cache(profile_name)
+        return success
+
+    def save_profile_files_batch(self, profile_name: str,
+                                 mapping: Dict[str, str]) -> Dict[str, bool]:
+        """
+        Сохраняет сразу несколько файлов профиля.
+
+        Папка профиля проверяется один раз, а загрузки идут параллельно —
+        при заполнении профиля это убирает повторные проверки папки
+        и накладывает загрузки друг на друга по времени.
+
+        Args:
+            profile_name: Имя профиля
+            mapping: Ключ файла -> текст (например {"king": "...", "rules": "..."})
+
+        Returns:
+            Словарь ключ файла -> успех записи
+        """
+        if not mapping:
+            return {}
+
+        self.disk.ensure_folder_exists(profile_name)
+
+        results = {}
+        max_workers = min(len(mapping), 5)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self.disk.write_file, f"{profile_name}/{key}.docx", content): key
+                for key, content in mapping.items()
+            }
+
+            for future in concurrent.futures.as_completed(futures):
+                key = futures[future]
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to save {key}.docx: {e}")
+                    results[key] = False
+
+        if any(results.values()):
+            self._invalidate_cache(profile_name)
+
+        return results
 
     def build_context(self, profile_name: str, limit: int = 10) -> str:
         """
@@ -93,57 +251,115 @@ class ProfileManager:
         - library.docx (опыт/знания)
         - последние N сообщений из логов
         """
-        files = self.get_profile_files(profile_name)
-        parts = []
-
-        if files.get('king'):
-            parts.append(f"ТЫ — ЛИЧНОСТЬ:\n{files['king']}\n")
-        if files.get('rules'):
-            parts.append(f"ПРАВИЛА ОБЩЕНИЯ:\n{files['rules']}\n")
-        if files.get('library'):
-            parts.append(f"ТВОИ ЗНАНИЯ И ОПЫТ:\n{files['library']}\n")
-
+        files = self.get_profile_files(profile_name, keys=("king", "rules", "library"))
         recent = self.get_recent_messages(profile_name, limit)
-        if recent:
-            parts.append(f"ПОСЛЕДНИЕ СООБЩЕНИЯ В ЧАТЕ:\n{recent}\n")
 
-        return "\n".join(parts)
+        sections = (
+            ("ТЫ — ЛИЧНОСТЬ:\n", files.get('king')),
+            ("ПРАВИЛА ОБЩЕНИЯ:\n", files.get('rules')),
+            ("ТВОИ ЗНАНИЯ И ОПЫТ:\n", files.get('library')),
+            ("ПОСЛЕДНИЕ СООБЩЕНИЯ В ЧАТЕ:\n", recent),
+        )
+
+        # Склеиваем заголовки и тексты напрямую, без промежуточных f-строк —
+        # содержимое library может быть большим, лишняя копия ни к чему
+        return ''.join(chain.from_iterable(
+            (header, content, '\n\n')
+            for header, content in sections if content
+        ))
 
     def save_message(self, profile_name: str, role: str, text: str, timestamp: datetime):
-        """Сохраняет сообщение в лог профиля (оставляем как .txt логи)"""
+        """
+        Сохраняет сообщение в лог профиля (оставляем как .txt логи).
+
+        Строки копятся в буфере и выгружаются на Диск пачкой —
+        по размеру буфера или по таймеру, а не по одному сообщению.
+        """
         try:
-            date_path = timestamp.strftime("%Y/%m/%d")
+            # Целочисленное форматирование заметно быстрее strftime
+            # и на горячем пути логирования это имеет значение
+            t = timestamp
+            date_path = f"{t.year}/{t.month:02d}/{t.day:02d}"
             log_path = f"{profile_name}/logs/{date_path}/log.txt"
 
-            folder_path = f"{profile_name}/logs/{date_path}"
-            self.disk.ensure_folder_exists(folder_path)
+            log_entry = f"[{t.hour:02d}:{t.minute:02d}:{t.second:02d}] {role}: {text}\n"
 
-            time_str = timestamp.strftime("%H:%M:%S")
-            log_entry = f"[{time_str}] {role}: {text}\n"
+            with self._log_lock:
+                self._log_buffers[log_path].append(log_entry)
+                self._last_flush.setdefault(log_path, time.monotonic())
+                buffer_full = len(self._log_buffers[log_path]) >= self._flush_batch_size
+                timed_out = time.monotonic() - self._last_flush[log_path] >= self._flush_interval
+
+            if buffer_full or timed_out:
+                self._flush_log(log_path)
+
+        except Exception as e:
+            logger.error(f"Failed to save message: {e}")
+
+    def _flush_log(self, log_path: str) -> bool:
+        """Выгружает накопленный буфер лога на Диск одной записью"""
+        # Дозапись — это download+concat+upload: два параллельных flush
+        # одного файла затёрли бы записи друг друга, поэтому пишем по одному
+        with self._flush_lock:
+            with self._log_lock:
+                entries = self._log_buffers.pop(log_path, [])
+                self._last_flush[log_path] = time.monotonic()
+
+            if not entries:
+                return True
+
+            folder_path = log_path.rsplit('/', 1)[0]
+            self.disk.ensure_folder_exists(folder_path)
 
-            success = self.disk._write_text_file(log_path, log_entry, append=True)
+            success = self.disk._write_text_file(log_path, ''.join(entries), append=True)
 
             if success:
-                logger.debug(f"Message saved to {log_path}")
+                logger.debug(f"Flushed {len(entries)} entries to {log_path}")
             else:
-                logger.error(f"Failed to save message to {log_path}")
+                logger.error(f"Failed to flush log to {log_path}")
+                # Возвращаем строки в буфер, чтобы не потерять их
+                with self._log_lock:
+                    self._log_buffers[log_path] = entries + self._log_buffers[log_path]
 
-        except Exception as e:
-            logger.error(f"Failed to save message: {e}")
+            return success
+
+    def _flush_all(self):
+        """Выгружает все непустые буферы логов (таймер и завершение процесса)"""
+        with self._log_lock:
+            pending = [path for path, entries in self._log_buffers.items() if entries]
+
+        for log_path in pending:
+            self._flush_log(log_path)
+
+    def _schedule_flush(self):
+        """Перезапускает фоновый таймер периодической выгрузки буферов"""
+        def _tick():
+            try:
+                self._flush_all()
+            finally:
+                self._schedule_flush()
+
+        timer = threading.Timer(self._flush_interval, _tick)
+        timer.daemon = True
+        timer.start()
+        self._flush_timer = timer
 
     def get_recent_messages(self, profile_name: str, limit: int = 10) -> str:
         """Читает последние сообщения из лога профиля"""
         today = datetime.now()
-        yesterday = datetime.now().replace(day=today.day - 1)
-
-        date_path = today.strftime("%Y/%m/%d")
-        log_path = f"{profile_name}/logs/{date_path}/log.txt"
-        content = self.disk._read_text_file(log_path)
-
-        if not content:
-            date_path = yesterday.strftime("%Y/%m/%d")
-            log_path = f"{profile_name}/logs/{date_path}/log.txt"
-            content = self.disk._read_text_file(log_path)
+        yesterday = today - timedelta(days=1)
+
+        # Запрашиваем оба дня сразу: на стыке суток это экономит
+        # целый сетевой round-trip
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(
+                    self.disk.read_text_tail,
+                    f"{profile_name}/logs/{day.strftime('%Y/%m/%d')}/log.txt"
+                )
+                for day in (today, yesterday)
+            ]
+            content = futures[0].result() or futures[1].result()
 
         if not content:
             return ""
@@ -153,24 +369,33 @@ class ProfileManager:
         return '\n'.join(last_lines)
 
     def add_to_library(self, profile_name: str, text: str) -> bool:
-        """Добавляет текст в library.docx профиля"""
+        """
+        Добавляет текст в library.docx профиля.
+
+        Дописывает параграфы в конец документа, не перечитывая
+        остальные файлы профиля и не пересобирая документ с нуля.
+        """
         try:
             path = f"{profile_name}/library.docx"
-            current = self.read_profile_file(profile_name, "library")
 
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            new_content = f"{current}\n\n[{timestamp}] ДОБАВЛЕНО:\n{text}" if current else text
+            lines = ["", f"[{timestamp}] ДОБАВЛЕНО:"] + text.split('\n')
 
-            return self.save_profile_file(profile_name, "library", new_content)
+            success = self.disk.append_docx(path, lines)
+            if success:
+                self._invalidate_cache(profile_name)
+            return success
 
         except Exception as e:
             logger.error(f"Error adding to library: {e}")
             return False
 
     def read_profile_file(self, profile_name: str, file_key: str) -> Optional[str]:
-        """Читает конкретный файл профиля"""
+        """Читает конкретный файл профиля, не скачивая остальные"""
         try:
-            files = self.get_profile_files(profile_name)
+            # Выборка одного ключа: кэш и скачивание берёт на себя
+            # get_profile_files, лишние четыре файла не трогаются
+            files = self.get_profile_files(profile_name, keys=(file_key,))
             return files.get(file_key)
         except Exception as e:
             logger.error(f"Error reading {file_key} for {profile_name}: {e}")
@@ -2,6 +2,7 @@
 Telegram бот для XLog — общение с множеством профилей (Логан, Марк, Вера и др.)
 """
 
+import asyncio
 import logging
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -111,8 +112,8 @@ class TelegramBot:
 
             logger.info(f"User {user_id} selected profile: {profile_name}")
 
-            # Загружаем все файлы профиля
-            files = self.profiles.get_profile_files(profile_name)
+            # Загружаем все файлы профиля (в потоке, чтобы не блокировать loop)
+            files = await self.profiles.aget_profile_files(profile_name)
 
             # Логируем, что пришло
             logger.info(f"FILES LOADED: {list(files.keys())}")
@@ -161,19 +162,22 @@ class TelegramBot:
         await update.message.chat.send_action(action="typing")
 
         # Сохраняем сообщение пользователя СРАЗУ, даже если DeepSeek упадёт
-        self.profiles.save_message(profile_name, "user", user_message, datetime.now())
+        await asyncio.to_thread(
+            self.profiles.save_message, profile_name, "user", user_message, datetime.now()
+        )
 
         try:
-            # Собираем контекст из файлов профиля
-            context_text = self.profiles.build_context(profile_name)
+            # Собираем контекст из файлов профиля (в потоке, не блокируя loop)
+            context_text = await self.profiles.abuild_context(profile_name)
 
             # Формируем историю для DeepSeek
             history = []
             if context_text:
                 history.append({"role": "system", "content": context_text})
 
-            # Отправляем в DeepSeek
-            response_data = self.deepseek.send_message(
+            # Отправляем в DeepSeek (блокирующий HTTP-запрос — тоже в поток)
+            response_data = await asyncio.to_thread(
+                self.deepseek.send_message,
                 chat_id=profile_name,
                 message=user_message,
                 history=history
@@ -183,7 +187,10 @@ class TelegramBot:
                 assistant_message = response_data["content"]
 
                 # Сохраняем ответ ассистента
-                self.profiles.save_message(profile_name, "assistant", assistant_message, datetime.now())
+                await asyncio.to_thread(
+                    self.profiles.save_message,
+                    profile_name, "assistant", assistant_message, datetime.now()
+                )
 
                 # Отправляем ответ пользователю
                 await update.message.reply_text(assistant_message)
@@ -195,7 +202,8 @@ class TelegramBot:
                 await update.message.reply_text(error_msg)
 
                 # Сохраняем ошибку как системное сообщение в лог
-                self.profiles.save_message(
+                await asyncio.to_thread(
+                    self.profiles.save_message,
                     profile_name,
                     "system",
                     f"Ошибка: пустой ответ от DeepSeek",
@@ -215,7 +223,8 @@ class TelegramBot:
             await update.message.reply_text(user_error_msg, parse_mode='Markdown')
 
             # Сохраняем факт ошибки в лог профиля
-            self.profiles.save_message(
+            await asyncio.to_thread(
+                self.profiles.save_message,
                 profile_name,
                 "system",
                 f"Ошибка DeepSeek: {error_text}",
@@ -1,13 +1,45 @@
-import os
+import asyncio
 import yadisk
 import io
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from yadisk.sessions.requests_session import RequestsSession
 from datetime import datetime
 from typing import Optional, List
-import tempfile
+from xml.sax.saxutils import escape
+
 from docx import Document
+from docx.oxml.ns import qn
+from lxml import etree
 
 from .logger import logger
 
+# Пространство имён WordprocessingML для сборки параграфов напрямую
+_W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+def _add_paragraphs_bulk(doc, lines):
+    """
+    Добавляет параграфы в документ одним разбором XML.
+
+    doc.add_paragraph в цикле строит lxml-дерево по одному элементу и
+    заметно тормозит на документах в тысячи строк; здесь весь блок
+    параграфов собирается строкой и парсится за один вызов.
+    """
+    xml = ''.join(
+        f'<w:p><w:r><w:t xml:space="preserve">{escape(line)}</w:t></w:r></w:p>'
+        for line in lines
+    )
+    fragment = etree.fromstring(f'<w:body xmlns:w="{_W_NS}">{xml}</w:body>')
+
+    body = doc.element.body
+    sect_pr = body.find(qn('w:sectPr'))
+    for paragraph in fragment:
+        if sect_pr is not None:
+            sect_pr.addprevious(paragraph)
+        else:
+            body.append(paragraph)
+
 # Пытаемся импортировать определение кодировки (оставим для TXT файлов)
 try:
     from charset_normalizer import from_bytes
@@ -28,9 +60,49 @@ class YandexDiskClient:
             token: OAuth-токен для доступа к Диску
             root_folder: Корневая папка проекта на Диске
         """
-        self.client = yadisk.Client(token=token)
+        # Одна постоянная HTTP-сессия с keep-alive: без неё каждый мелкий
+        # запрос (mkdir, get_meta) может платить за новый TLS-handshake.
+        # Retry дополнительно сглаживает транзиентные 5xx/429 от API
+        session = RequestsSession()
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=16,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504]
+            )
+        )
+        session.requests_session.mount('https://', adapter)
+        self.session = session
+
+        self.client = yadisk.Client(token=token, session=session)
         self.root_folder = root_folder
 
+        # Папки, существование которых уже подтверждено в этом процессе —
+        # чтобы не дёргать exists/mkdir на каждую запись
+        self._known_folders: set = set()
+
+        # Содержимое уже просмотренных папок: путь -> множество имён детей.
+        # Один listdir родителя отвечает на вопрос о всех его подпапках сразу
+        self._folder_children_cache: dict = {}
+
+        # Кэш распарсенных DOCX: full_path -> (md5, текст).
+        # Пока md5 на Диске не изменился, файл не скачиваем и не парсим заново
+        self._docx_cache: dict = {}
+
+        # Кэш определённых кодировок текстовых файлов: remote_path -> encoding,
+        # чтобы не гонять charset-normalizer по одному и тому же файлу
+        self._encoding_cache: dict = {}
+
+        # Разобранные Document-объекты для дозаписи: full_path -> (md5, Document).
+        # Повторный append не скачивает и не парсит документ заново,
+        # пока md5 на Диске совпадает с сохранённым
+        self._doc_objects: dict = {}
+
+        # Незавершённые асинхронные чтения DOCX (singleflight)
+        self._inflight: dict = {}
+
         # Проверяем, что токен рабочий
         if not self.client.check_token():
             logger.error("Invalid Yandex Disk token")
@@ -49,6 +121,11 @@ class YandexDiskClient:
             True если папка существует или была создана
         """
         full_path = f"/{self.root_folder}/{remote_path}"
+
+        # Уже проверяли эту папку — лишние HTTP-запросы не нужны
+        if full_path in self._known_folders:
+            return True
+
         try:
             # Разбиваем путь на части и создаём каждую папку по очереди
             current_path = f"/{self.root_folder}"
@@ -57,10 +134,31 @@ class YandexDiskClient:
             for part in parts:
                 if not part:  # Пропускаем пустые части
                     continue
+                parent_path = current_path
                 current_path += f"/{part}"
-                if not self.client.exists(current_path):
-                    self.client.mkdir(current_path)
-                    logger.debug(f"Created directory: {current_path}")
+                if current_path in self._known_folders:
+                    continue
+
+                # Один listdir родителя говорит, какие подпапки уже есть
+                children = self._folder_children_cache.get(parent_path)
+                if children is None:
+                    try:
+                        children = {item.name for item in self.client.listdir(parent_path)}
+                    except yadisk.exceptions.PathNotFoundError:
+                        children = set()
+                    self._folder_children_cache[parent_path] = children
+
+                if part not in children:
+                    try:
+                        self.client.mkdir(current_path)
+                        # Свежесозданная папка гарантированно пуста
+                        self._folder_children_cache[current_path] = set()
+                        logger.debug(f"Created directory: {current_path}")
+                    except yadisk.exceptions.DirectoryExistsError:
+                        pass
+                    children.add(part)
+
+                self._known_folders.add(current_path)
 
             return True
 
@@ -88,33 +186,52 @@ class YandexDiskClient:
             Текст из документа или None
         """
         full_path = f"/{self.root_folder}/{remote_path}"
-        temp_file = None
 
         try:
-            if not self.client.exists(full_path):
-                return None
-
-            # Скачиваем файл во временный
-            with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as tf:
-                temp_file = tf.name
-                self.client.download(full_path, temp_file)
+            # Сверяем md5 на Диске с кэшем: метаданные дешевле скачивания + парсинга
+            meta = self.client.get_meta(full_path, fields=["md5"])
+            cached = self._docx_cache.get(full_path)
+            if cached and cached[0] == meta.md5:
+                logger.debug(f"DOCX {remote_path} served from cache (md5 match)")
+                return cached[1]
+
+            # Скачиваем файл прямо в память; отсутствие файла — не ошибка
+            buf = io.BytesIO()
+            self.client.download(full_path, buf)
+            buf.seek(0)
 
             # Открываем через python-docx
-            doc = Document(temp_file)
+            doc = Document(buf)
 
             # Собираем весь текст из параграфов
             text = '\n'.join([paragraph.text for paragraph in doc.paragraphs])
 
+            self._docx_cache[full_path] = (meta.md5, text)
+
             logger.info(f"✅ Successfully read DOCX {remote_path} ({len(text)} chars)")
             return text
 
+        except yadisk.exceptions.PathNotFoundError:
+            return None
+
         except Exception as e:
             logger.error(f"Failed to read DOCX {full_path}: {e}")
             return None
 
-        finally:
-            if temp_file and os.path.exists(temp_file):
-                os.unlink(temp_file)
+    async def aread_docx(self, remote_path: str) -> Optional[str]:
+        """
+        Асинхронный вариант read_docx для вызова из event loop.
+
+        Чтение уходит в поток, а одновременные запросы одного файла
+        ждут одну задачу вместо повторного скачивания (singleflight).
+        """
+        task = self._inflight.get(remote_path)
+        if task is None:
+            task = asyncio.create_task(asyncio.to_thread(self.read_docx, remote_path))
+            self._inflight[remote_path] = task
+            task.add_done_callback(lambda _: self._inflight.pop(remote_path, None))
+
+        return await task
 
     def write_docx(self, remote_path: str, content: str) -> bool:
         """
@@ -128,7 +245,6 @@ class YandexDiskClient:
             True если успешно
         """
         full_path = f"/{self.root_folder}/{remote_path}"
-        temp_file = None
 
         try:
             # Убеждаемся, что папка для файла существует
@@ -136,22 +252,20 @@ class YandexDiskClient:
             if folder_path:
                 self.ensure_folder_exists(folder_path)
 
-            # Создаём временный DOCX файл
-            with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as tf:
-                temp_file = tf.name
+            # Создаём новый документ
+            doc = Document()
 
-                # Создаём новый документ
-                doc = Document()
+            # Добавляем текст (разбиваем по строкам, параграфы — одним блоком)
+            _add_paragraphs_bulk(doc, content.split('\n'))
 
-                # Добавляем текст (разбиваем по строкам)
-                for line in content.split('\n'):
-                    doc.add_paragraph(line)
+            # Сохраняем в память и загружаем на Диск
+            buf = io.BytesIO()
+            doc.save(buf)
+            buf.seek(0)
+            self.client.upload(buf, full_path, overwrite=True)
 
-                # Сохраняем
-                doc.save(temp_file)
-
-            # Загружаем на Диск
-            self.client.upload(temp_file, full_path, overwrite=True)
+            self._docx_cache.pop(full_path, None)
+            self._doc_objects.pop(full_path, None)
 
             logger.info(f"✅ Successfully wrote DOCX {remote_path} ({len(content)} chars)")
             return True
@@ -160,16 +274,129 @@ class YandexDiskClient:
             logger.error(f"Failed to write DOCX {full_path}: {e}")
             return False
 
-        finally:
-            if temp_file and os.path.exists(temp_file):
-                os.unlink(temp_file)
+    def append_docx(self, remote_path: str, lines: List[str]) -> bool:
+        """
+        Дописывает строки в конец DOCX файла.
+
+        Document-объект кэшируется между вызовами, поэтому повторная
+        дозапись не скачивает и не парсит документ заново — только
+        добавляет параграфы и загружает результат.
+
+        Args:
+            remote_path: Путь к файлу на Яндекс.Диске (относительно корня)
+            lines: Строки — каждая станет отдельным параграфом
+
+        Returns:
+            True если успешно
+        """
+        full_path = f"/{self.root_folder}/{remote_path}"
+
+        try:
+            folder_path = '/'.join(remote_path.split('/')[:-1])
+            if folder_path:
+                self.ensure_folder_exists(folder_path)
+
+            try:
+                remote_md5 = self.client.get_meta(full_path, fields=["md5"]).md5
+            except yadisk.exceptions.PathNotFoundError:
+                remote_md5 = None
+
+            # Кэшированный Document можно переиспользовать только пока файл
+            # на Диске не менялся — иначе append затёр бы чужие правки
+            doc = None
+            cached = self._doc_objects.get(full_path)
+            if cached is not None:
+                cached_md5, cached_doc = cached
+                if remote_md5 is not None and cached_md5 == remote_md5:
+                    doc = cached_doc
+                else:
+                    self._doc_objects.pop(full_path, None)
+
+            if doc is None:
+                if remote_md5 is not None:
+                    buf = io.BytesIO()
+                    self.client.download(full_path, buf)
+                    buf.seek(0)
+                    doc = Document(buf)
+                else:
+                    doc = Document()
+
+            for line in lines:
+                doc.add_paragraph(line)
+
+            out = io.BytesIO()
+            doc.save(out)
+            out.seek(0)
+            self.client.upload(out, full_path, overwrite=True)
+
+            self._docx_cache.pop(full_path, None)
+
+            # Запоминаем md5 загруженной версии вместе с Document;
+            # если её не узнать — кэш не сохраняем, повторный append перечитает
+            try:
+                new_md5 = self.client.get_meta(full_path, fields=["md5"]).md5
+                self._doc_objects[full_path] = (new_md5, doc)
+            except Exception:
+                self._doc_objects.pop(full_path, None)
+
+            # Обновляем текстовое зеркало, чтобы read_file не отдал старый текст;
+            # если обновить не вышло — удаляем, устаревшее зеркало хуже его отсутствия
+            text = '\n'.join(paragraph.text for paragraph in doc.paragraphs)
+            mirror_path = self._mirror_path(remote_path)
+            if not self._write_text_file(mirror_path, text):
+                try:
+                    self.client.remove(f"/{self.root_folder}/{mirror_path}", permanently=True)
+                except yadisk.exceptions.PathNotFoundError:
+                    pass
+                except Exception as e:
+                    logger.warning(f"Failed to drop stale mirror {mirror_path}: {e}")
+
+            logger.info(f"✅ Appended {len(lines)} paragraphs to DOCX {remote_path}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to append to DOCX {full_path}: {e}")
+            return False
+
+    def _mirror_path(self, remote_path: str) -> str:
+        """Путь к текстовому зеркалу DOCX файла: folder/.cache/name.txt"""
+        folder, _, file_name = remote_path.rpartition('/')
+        stem = file_name[:-len('.docx')]
+        prefix = f"{folder}/" if folder else ""
+        return f"{prefix}.cache/{stem}.txt"
+
+    def _mirror_is_fresh(self, remote_path: str) -> bool:
+        """
+        Проверяет, что текстовое зеркало не старше самого DOCX.
+
+        DOCX могли отредактировать прямо на Диске — тогда зеркало
+        устарело и доверять ему нельзя.
+        """
+        try:
+            docx_meta = self.client.get_meta(
+                f"/{self.root_folder}/{remote_path}", fields=["modified"])
+            mirror_meta = self.client.get_meta(
+                f"/{self.root_folder}/{self._mirror_path(remote_path)}",
+                fields=["modified"])
+        except yadisk.exceptions.PathNotFoundError:
+            return False
+
+        if docx_meta.modified is None or mirror_meta.modified is None:
+            return False
+        return mirror_meta.modified >= docx_meta.modified
 
     def read_file(self, remote_path: str) -> Optional[str]:
         """
-        Универсальное чтение файла. Если файл .docx — использует read_docx.
-        Если .txt — использует старое чтение с определением кодировки.
+        Универсальное чтение файла. Если файл .docx — сначала пробует
+        текстовое зеркало (дешёвый download + decode без zip/XML),
+        если оно не старше DOCX; иначе читает сам DOCX. Если .txt —
+        использует старое чтение с определением кодировки.
         """
-        if remote_path.lower().endswith('.docx'):
+        if remote_path.endswith(('.docx', '.DOCX')):
+            if self._mirror_is_fresh(remote_path):
+                mirror = self._read_text_file(self._mirror_path(remote_path))
+                if mirror is not None:
+                    return mirror
             return self.read_docx(remote_path)
         else:
             return self._read_text_file(remote_path)
@@ -179,23 +406,32 @@ class YandexDiskClient:
         Читает текстовый файл с автоопределением кодировки.
         """
         full_path = f"/{self.root_folder}/{remote_path}"
-        temp_file = None
 
         try:
-            if not self.client.exists(full_path):
-                return None
+            buf = io.BytesIO()
+            self.client.download(full_path, buf)
+            raw_data = buf.getvalue()
 
-            with tempfile.NamedTemporaryFile(mode='rb', delete=False) as tf:
-                temp_file = tf.name
-                self.client.download(full_path, temp_file)
+            # Логи пишет этот же код в UTF-8 — определять кодировку незачем
+            if remote_path.endswith('log.txt'):
+                return raw_data.decode('utf-8', errors='replace')
 
-            with open(temp_file, 'rb') as f:
-                raw_data = f.read()
+            # Кодировка этого файла уже известна — декодируем сразу
+            known_encoding = self._encoding_cache.get(remote_path)
+            if known_encoding:
+                try:
+                    content = raw_data.decode(known_encoding)
+                    if content and content.startswith('\ufeff'):
+                        content = content[1:]
+                    return content
+                except (UnicodeDecodeError, LookupError):
+                    self._encoding_cache.pop(remote_path, None)
 
             if CHARSET_DETECT_AVAILABLE and raw_data:
                 try:
                     result = from_bytes(raw_data).best()
                     if result:
+                        self._encoding_cache[remote_path] = result.encoding
                         content = str(result)
                         if content and content.startswith('\ufeff'):
                             content = content[1:]
@@ -206,59 +442,125 @@ class YandexDiskClient:
             # Fallback
             return self._fallback_decode(raw_data, remote_path)
 
+        except yadisk.exceptions.PathNotFoundError:
+            return None
+
         except Exception as e:
             logger.error(f"Failed to read {full_path}: {e}")
             return None
 
-        finally:
-            if temp_file and os.path.exists(temp_file):
-                os.unlink(temp_file)
+    def read_text_tail(self, remote_path: str, max_bytes: int = 8192) -> Optional[str]:
+        """
+        Читает только хвост текстового файла через HTTP Range-запрос.
 
-    def _fallback_decode(self, raw_data: bytes, remote_path: str) -> Optional[str]:
-        """Запасной метод с перебором кодировок"""
-        encodings = ['utf-8', 'windows-1251', 'koi8-r', 'cp866', 'iso-8859-5']
+        Полезно для больших логов: вызывающему нужны последние строки,
+        а не весь файл за день.
 
-        for encoding in encodings:
-            try:
-                content = raw_data.decode(encoding)
-                logger.info(f"Fallback: {remote_path} decoded as {encoding}")
-                if content and content.startswith('\ufeff'):
-                    content = content[1:]
-                return content
-            except UnicodeDecodeError:
-                continue
+        Args:
+            remote_path: Путь к файлу на Яндекс.Диске (относительно корня)
+            max_bytes: Сколько байт с конца файла запрашивать
+
+        Returns:
+            Хвост файла (без возможно обрезанной первой строки) или None
+        """
+        full_path = f"/{self.root_folder}/{remote_path}"
 
         try:
-            return raw_data.decode('utf-8', errors='ignore')
-        except:
+            href = self.client.get_download_link(full_path)
+            response = requests.get(
+                href,
+                headers={'Range': f'bytes=-{max_bytes}'},
+                timeout=30
+            )
+            response.raise_for_status()
+
+            encoding = self._encoding_cache.get(remote_path, 'utf-8')
+            content = response.content.decode(encoding, errors='replace')
+
+            # Если сервер отдал не файл целиком, первая строка могла быть
+            # обрезана посередине — отбрасываем её
+            content_range = response.headers.get('Content-Range', '')
+            truncated = (response.status_code == 206
+                         and not content_range.startswith('bytes 0-'))
+            if truncated and '\n' in content:
+                content = content.split('\n', 1)[1]
+
+            return content
+
+        except yadisk.exceptions.PathNotFoundError:
             return None
 
+        except Exception as e:
+            logger.error(f"Failed to read tail of {full_path}: {e}")
+            return None
+
+    def _fallback_decode(self, raw_data: bytes, remote_path: str) -> Optional[str]:
+        """Запасной метод: BOM-сниффинг, затем UTF-8, затем cp1251"""
+        # Сначала смотрим BOM — это решает вопрос без сканирования данных
+        if raw_data.startswith(b'\xef\xbb\xbf'):
+            return raw_data.decode('utf-8-sig', errors='replace')
+        if raw_data.startswith((b'\xff\xfe', b'\xfe\xff')):
+            # Кодек utf-16 сам определяет порядок байт по BOM и съедает его
+            return raw_data.decode('utf-16', errors='replace')
+
+        # Типичный случай — UTF-8 (эти файлы пишет сам XLog)
+        try:
+            return raw_data.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+
+        # Доминирующая legacy-кодировка кириллицы
+        try:
+            content = raw_data.decode('cp1251')
+            logger.info(f"Fallback: {remote_path} decoded as cp1251")
+            return content
+        except UnicodeDecodeError:
+            pass
+
+        return raw_data.decode('utf-8', errors='replace')
+
     def write_file(self, remote_path: str, content: str) -> bool:
         """
-        Универсальная запись файла. Если путь заканчивается на .docx — создаёт DOCX.
-        Иначе — обычный текст.
+        Универсальная запись файла. Если путь заканчивается на .docx — создаёт DOCX
+        и обновляет его текстовое зеркало. Иначе — обычный текст.
         """
-        if remote_path.lower().endswith('.docx'):
-            return self.write_docx(remote_path, content)
+        if remote_path.endswith(('.docx', '.DOCX')):
+            success = self.write_docx(remote_path, content)
+            if success:
+                # Зеркало опционально: DOCX уже записан, промах просто
+                # вернёт чтение на медленный путь
+                self._write_text_file(self._mirror_path(remote_path), content)
+            return success
         else:
             return self._write_text_file(remote_path, content)
 
-    def _write_text_file(self, remote_path: str, content: str) -> bool:
-        """Записывает текстовый файл в UTF-8"""
+    def _write_text_file(self, remote_path: str, content: str, append: bool = False) -> bool:
+        """
+        Записывает текстовый файл в UTF-8.
+
+        Args:
+            remote_path: Путь к файлу на Яндекс.Диске (относительно корня)
+            content: Текст для записи
+            append: Если True — дописывает в конец существующего файла
+        """
         full_path = f"/{self.root_folder}/{remote_path}"
-        temp_file = None
 
         try:
             folder_path = '/'.join(remote_path.split('/')[:-1])
             if folder_path:
                 self.ensure_folder_exists(folder_path)
 
-            with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8', delete=False) as tf:
-                temp_file = tf.name
-                tf.write(content)
-                tf.flush()
+            if append:
+                existing = self._read_text_file(remote_path)
+                if existing:
+                    content = existing + content
+
+            buf = io.BytesIO(content.encode('utf-8'))
+            self.client.upload(buf, full_path, overwrite=True)
+
+            # Файл теперь гарантированно в UTF-8
+            self._encoding_cache[remote_path] = 'utf-8'
 
-            self.client.upload(temp_file, full_path, overwrite=True)
             logger.debug(f"Written to {full_path}")
             return True
 
@@ -266,10 +568,6 @@ class YandexDiskClient:
             logger.error(f"Failed to write to {full_path}: {e}")
             return False
 
-        finally:
-            if temp_file and os.path.exists(temp_file):
-                os.unlink(temp_file)
-
     def list_files(self, remote_path: str) -> List[str]:
         """
         Возвращает список файлов в папке.
@@ -282,9 +580,9 @@ class YandexDiskClient:
         """
         full_path = f"/{self.root_folder}/{remote_path}"
         try:
-            if not self.client.exists(full_path):
-                return []
             return [item.name for item in self.client.listdir(full_path)]
+        except yadisk.exceptions.PathNotFoundError:
+            return []
         except Exception as e:
             logger.error(f"Failed to list {full_path}: {e}")
             return []
\ No newline at end of file